@@ -1,4 +1,4 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 import os
 from dotenv import load_dotenv
 import praw
@@ -8,6 +8,13 @@ from datetime import datetime
 import json
 import time
 import schedule
+import random
+import hmac
+import threading
+import io
+import cProfile
+import pstats
+import tracemalloc
 
 # Load environment variables
 load_dotenv()
@@ -22,12 +29,16 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 
+def create_reddit_client():
+    """Create a Reddit client from environment variables."""
+    return praw.Reddit(
+        client_id=os.getenv('REDDIT_CLIENT_ID'),
+        client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
+        user_agent=os.getenv('REDDIT_USER_AGENT', 'RedditToTwitterBot/1.0')
+    )
+
 # Initialize Reddit client
-reddit = praw.Reddit(
-    client_id=os.getenv('REDDIT_CLIENT_ID'),
-    client_secret=os.getenv('REDDIT_CLIENT_SECRET'),
-    user_agent=os.getenv('REDDIT_USER_AGENT', 'RedditToTwitterBot/1.0')
-)
+reddit = create_reddit_client()
 
 # Initialize Twitter client
 twitter_client = tweepy.Client(
@@ -37,6 +48,16 @@ twitter_client = tweepy.Client(
     access_token_secret=os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
 )
 
+# Profiling settings (off unless PROFILE_SAMPLE_RATE or DEBUG_PROFILE_TOKEN is set)
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '20'))
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', '20'))
+DEBUG_PROFILE_TOKEN = os.getenv('DEBUG_PROFILE_TOKEN')
+
+# cProfile and tracemalloc are process-wide, so only one profiled run at a time
+profile_lock = threading.Lock()
+
 def load_posted_threads():
     """Load the list of previously posted thread IDs from a JSON file."""
     try:
@@ -45,6 +66,24 @@ def load_posted_threads():
     except FileNotFoundError:
         return []
 
+def next_candidate(posted_threads):
+    """Return the first backfilled candidate from candidates.jsonl that hasn't been posted yet."""
+    posted_threads = set(posted_threads)
+    try:
+        with open('candidates.jsonl', 'r') as f:
+            # Stream the file so a large backfill is never loaded into memory at once
+            for line in f:
+                try:
+                    candidate = json.loads(line)
+                    thread_id = candidate['id']
+                except (ValueError, KeyError):
+                    continue
+                if thread_id not in posted_threads:
+                    return candidate
+    except FileNotFoundError:
+        pass
+    return None
+
 def save_posted_threads(thread_ids):
     """Save the list of posted thread IDs to a JSON file."""
     with open('posted_threads.json', 'w') as f:
@@ -172,23 +211,40 @@ def post_reddit_update():
                 selected_post = post
                 break
         
-        if not selected_post:
-            logger.info("No new posts to tweet")
-            return
-        
-        logger.info(f"\nSelected post to tweet: {selected_post.title}")
+        if selected_post:
+            logger.info(f"\nSelected post to tweet: {selected_post.title}")
+            thread_id = selected_post.id
+            title = selected_post.title
+            url = selected_post.url
+            
+            # Get thread summary
+            summary = get_thread_summary(selected_post)
+            
+            # Generate engagement question
+            question = get_engagement_question(selected_post.title)
+        else:
+            # Fall back to the queue seeded by backfill.py
+            candidate = next_candidate(posted_threads)
+            if not candidate:
+                logger.info("No new posts to tweet")
+                return
+            
+            logger.info(f"\nNo new hot posts, selected backfilled candidate: {candidate['title']}")
+            thread_id = candidate['id']
+            title = candidate['title']
+            url = candidate['url']
+            summary = candidate.get('summary')
+            question = candidate['question']
         
-        # Get thread summary
-        summary = get_thread_summary(selected_post)
         if summary:
             logger.info(f"Thread summary: {summary}")
-        
-        # Generate engagement question
-        question = get_engagement_question(selected_post.title)
         logger.info(f"Selected engagement question: {question}")
         
         # Prepare tweet text
-        tweet_text = f"{selected_post.title}\n\n{summary}\n\n{question}\n\n{selected_post.url}"
+        if summary:
+            tweet_text = f"{title}\n\n{summary}\n\n{question}\n\n{url}"
+        else:
+            tweet_text = f"{title}\n\n{question}\n\n{url}"
         tweet_text = truncate_text(tweet_text)
         
         logger.info(f"Preparing to tweet:\n{tweet_text}")
@@ -209,7 +265,7 @@ def post_reddit_update():
             logger.info(f"Successfully posted! Tweet ID: {response.data['id']}")
             
             # Save posted thread ID
-            posted_threads.append(selected_post.id)
+            posted_threads.append(thread_id)
             save_posted_threads(posted_threads)
             logger.info(f"Successfully posted tweet ID: {response.data['id']}")
             logger.info(f"Tweet content:\n{tweet_text}")
@@ -222,6 +278,105 @@ def post_reddit_update():
         logger.error(f"Error in post_reddit_update: {str(e)}")
         raise
 
+def profile_update():
+    """Profile a single post_reddit_update() run; callers must hold profile_lock."""
+    # Only reset or stop tracemalloc if we were the ones who started it, so another
+    # user of tracemalloc (e.g. PYTHONTRACEMALLOC) keeps its own peak
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    baseline_bytes = tracemalloc.get_traced_memory()[0]
+    
+    profiler = cProfile.Profile()
+    error = None
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        post_reddit_update()
+    except Exception as e:
+        error = e
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        current_bytes, peak_bytes = tracemalloc.get_traced_memory()
+        if started_tracing:
+            tracemalloc.stop()
+    
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler, stream=stream)
+    stats.sort_stats('cumulative').print_stats(PROFILE_TOP_N)
+    logger.info(f"Profiled update in {elapsed:.3f}s, peak memory {peak_bytes / 1024:.1f} KiB")
+    
+    # The update may already have tweeted, so failing to save the profile must not fail it
+    stats_path, summary_path = None, None
+    try:
+        stats_path, summary_path = save_profile(profiler, stream.getvalue(), elapsed, baseline_bytes,
+                                                current_bytes, peak_bytes, started_tracing, error)
+    except Exception as e:
+        logger.error(f"Error saving profile: {str(e)}")
+    
+    if error:
+        raise error
+    
+    return {
+        "stats_file": stats_path,
+        "summary_file": summary_path,
+        "wall_time_seconds": round(elapsed, 3),
+        "baseline_memory_bytes": baseline_bytes,
+        "peak_memory_bytes": peak_bytes,
+        "peak_includes_earlier_activity": not started_tracing,
+        "top_functions": stream.getvalue()
+    }
+
+def save_profile(profiler, top_functions, elapsed, baseline_bytes, current_bytes, peak_bytes,
+                 started_tracing, error):
+    """Save the full pstats file and a short top-N summary, then prune old profiles."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    stats_path = os.path.join(PROFILE_DIR, f"update_{timestamp}.pstats")
+    summary_path = os.path.join(PROFILE_DIR, f"update_{timestamp}.txt")
+    
+    profiler.dump_stats(stats_path)
+    with open(summary_path, 'w') as f:
+        f.write(f"Wall time: {elapsed:.3f}s\n")
+        f.write(f"Traced memory at start: {baseline_bytes / 1024:.1f} KiB\n")
+        if started_tracing:
+            f.write(f"Peak traced memory: {peak_bytes / 1024:.1f} KiB\n")
+        else:
+            f.write(f"Peak traced memory (since tracemalloc was started elsewhere): {peak_bytes / 1024:.1f} KiB\n")
+        f.write(f"Current traced memory: {current_bytes / 1024:.1f} KiB\n")
+        if error:
+            f.write(f"Error: {str(error)}\n")
+        f.write(top_functions)
+    logger.info(f"Profile saved to {stats_path}, summary saved to {summary_path}")
+    
+    prune_profiles()
+    return stats_path, summary_path
+
+def prune_profiles():
+    """Delete all but the newest PROFILE_KEEP profiles from PROFILE_DIR."""
+    # Timestamps in the file names sort chronologically
+    runs = sorted(name[:-len('.pstats')] for name in os.listdir(PROFILE_DIR)
+                  if name.startswith('update_') and name.endswith('.pstats'))
+    for run in runs[:max(len(runs) - PROFILE_KEEP, 0)]:
+        for ext in ('.pstats', '.txt'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, run + ext))
+            except FileNotFoundError:
+                pass
+
+def run_update():
+    """Run an update, profiling a sampled fraction of runs."""
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        # If another profiled run holds the lock, run this update unprofiled instead
+        if profile_lock.acquire(blocking=False):
+            try:
+                profile_update()
+            finally:
+                profile_lock.release()
+            return
+    post_reddit_update()
+
 @app.route('/')
 def home():
     """Home route that shows the app is running."""
@@ -234,7 +389,7 @@ def home():
 def trigger_update():
     """Endpoint to manually trigger a Reddit update."""
     try:
-        post_reddit_update()
+        run_update()
         return jsonify({
             "status": "success",
             "message": "Update completed successfully"
@@ -245,9 +400,49 @@ def trigger_update():
             "message": str(e)
         }), 500
 
+@app.route('/debug/profile', methods=['POST'])
+def debug_profile():
+    """Endpoint to run (and tweet) a single profiled update, guarded by DEBUG_PROFILE_TOKEN."""
+    if not DEBUG_PROFILE_TOKEN:
+        return jsonify({
+            "status": "error",
+            "message": "Not found"
+        }), 404
+    
+    # Header only: query strings end up in the request logs
+    # Werkzeug decodes headers as latin-1; compare bytes so non-ASCII tokens get a 403, not a TypeError
+    token = request.headers.get('X-Profile-Token', '').encode('latin-1', errors='replace')
+    if not hmac.compare_digest(token, DEBUG_PROFILE_TOKEN.encode('utf-8')):
+        return jsonify({
+            "status": "error",
+            "message": "Forbidden"
+        }), 403
+    
+    # Report "busy" separately from a failed update, which may already have tweeted
+    if not profile_lock.acquire(blocking=False):
+        return jsonify({
+            "status": "busy",
+            "message": "A profiled update is already running"
+        }), 409
+    
+    try:
+        profile = profile_update()
+        return jsonify({
+            "status": "success",
+            "message": "Profiled update completed successfully",
+            "profile": profile
+        })
+    except Exception as e:
+        return jsonify({
+            "status": "error",
+            "message": str(e)
+        }), 500
+    finally:
+        profile_lock.release()
+
 def run_scheduler():
     """Run the scheduler to post updates periodically."""
-    schedule.every(15).minutes.do(post_reddit_update)
+    schedule.every(15).minutes.do(run_update)
     
     while True:
         schedule.run_pending()
@@ -255,7 +450,6 @@ def run_scheduler():
 
 if __name__ == '__main__':
     # Start the scheduler in a separate thread
-    import threading
     scheduler_thread = threading.Thread(target=run_scheduler, daemon=True)
     scheduler_thread.start()
     
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import logging
+import argparse
+import threading
+import fcntl
+from concurrent.futures import ThreadPoolExecutor
+
+from app import create_reddit_client, get_thread_summary, get_engagement_question, load_posted_threads
+
+logger = logging.getLogger(__name__)
+
+# Candidate posts are appended here, one JSON object per line; app.next_candidate() reads them
+CANDIDATES_FILE = 'candidates.jsonl'
+
+# Progress of every backfilled listing, keyed by "subreddit:time_filter" and rewritten after every page
+CHECKPOINT_FILE = 'backfill_checkpoint.json'
+
+# Held for the whole run so two backfills never write the same files at once
+LOCK_FILE = 'backfill.lock'
+
+# Reddit returns at most 100 posts per listing page
+PAGE_SIZE = 100
+
+# PRAW isn't thread-safe, so each worker thread gets its own Reddit client
+worker_state = threading.local()
+
+def init_worker():
+    """Create the Reddit client used by the current worker thread."""
+    worker_state.reddit = create_reddit_client()
+
+def load_checkpoints():
+    """Load the checkpoints of all listings."""
+    try:
+        with open(CHECKPOINT_FILE, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_checkpoints(checkpoints):
+    """Atomically save the checkpoints so a crash never leaves a partial file."""
+    tmp_file = f"{CHECKPOINT_FILE}.tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(checkpoints, f)
+    os.replace(tmp_file, CHECKPOINT_FILE)
+
+def acquire_run_lock():
+    """Take the exclusive backfill lock, raising if another backfill already holds it."""
+    lock = open(LOCK_FILE, 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        raise RuntimeError(f"Another backfill is already running (lock held on {LOCK_FILE})")
+    return lock
+
+def load_candidate_ids():
+    """Return the ids already in the candidate store, dropping a partially written last line."""
+    candidate_ids = set()
+    if not os.path.exists(CANDIDATES_FILE):
+        return candidate_ids
+
+    complete_size = 0
+    with open(CANDIDATES_FILE, 'rb') as f:
+        for line_number, line in enumerate(f, start=1):
+            # Only the last line can lack a newline, and that's what's left of an interrupted write
+            if not line.endswith(b'\n'):
+                break
+            complete_size += len(line)
+            try:
+                candidate_ids.add(json.loads(line)['id'])
+            except (ValueError, KeyError):
+                logger.warning(f"Skipping invalid line {line_number} in {CANDIDATES_FILE}")
+
+    if complete_size < os.path.getsize(CANDIDATES_FILE):
+        logger.warning(f"Dropping partially written last line of {CANDIDATES_FILE}")
+        with open(CANDIDATES_FILE, 'r+b') as f:
+            f.truncate(complete_size)
+    return candidate_ids
+
+def build_candidate(post, time_filter):
+    """Build a candidate record for a post, or None if no summary could be built."""
+    # Re-fetch through this worker's own client rather than the listing's shared one
+    submission = worker_state.reddit.submission(id=post.id)
+    summary = get_thread_summary(submission)
+    if not summary:
+        # Could be a rate limit or network error, so leave the post for a later run
+        return None
+    return {
+        "id": post.id,
+        "title": post.title,
+        "url": f"https://reddit.com{post.permalink}",
+        "score": post.score,
+        "created_utc": post.created_utc,
+        "summary": summary,
+        "question": get_engagement_question(post.title),
+        "source": f"top:{time_filter}"
+    }
+
+def backfill(subreddit_name='BestofRedditorUpdates', time_filter='month', max_posts=None, workers=4,
+             restart=False):
+    """Page through a top() listing and stream new candidate posts into the candidate store."""
+    lock = acquire_run_lock()
+    try:
+        return _backfill(subreddit_name, time_filter, max_posts, workers, restart)
+    finally:
+        lock.close()
+
+def _backfill(subreddit_name, time_filter, max_posts, workers, restart):
+    """Run the backfill; callers must hold the backfill lock."""
+    posted_threads = set(load_posted_threads())
+    candidate_ids = load_candidate_ids()
+    subreddit = create_reddit_client().subreddit(subreddit_name)
+
+    key = f"{subreddit_name}:{time_filter}"
+    checkpoints = load_checkpoints()
+    checkpoint = None if restart else checkpoints.get(key)
+    if checkpoint and checkpoint.get('done'):
+        logger.info("Backfill already completed for this listing, use --restart to run it again")
+        return checkpoint
+
+    if checkpoint:
+        logger.info(f"Resuming backfill after {checkpoint['processed']} posts")
+    else:
+        checkpoint = {
+            "after": None,
+            "processed": 0,
+            "written": 0,
+            "done": False
+        }
+        checkpoints[key] = checkpoint
+        save_checkpoints(checkpoints)
+
+    start = time.perf_counter()
+    processed_this_run = 0
+
+    with open(CANDIDATES_FILE, 'ab') as candidates, \
+            ThreadPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        while max_posts is None or processed_this_run < max_posts:
+            limit = PAGE_SIZE
+            if max_posts is not None:
+                limit = min(limit, max_posts - processed_this_run)
+
+            params = {'after': checkpoint['after']} if checkpoint['after'] else {}
+            page = list(subreddit.top(time_filter=time_filter, limit=limit, params=params))
+            if not page:
+                checkpoint['done'] = True
+                save_checkpoints(checkpoints)
+                break
+
+            # Only one page is in flight at a time, which bounds both concurrency and memory
+            selected = [post for post in page if not post.stickied
+                        and post.id not in posted_threads and post.id not in candidate_ids]
+            written = 0
+            for candidate in executor.map(lambda post: build_candidate(post, time_filter), selected):
+                if candidate is None:
+                    continue
+                candidates.write((json.dumps(candidate) + '\n').encode('utf-8'))
+                candidate_ids.add(candidate['id'])
+                written += 1
+            candidates.flush()
+            os.fsync(candidates.fileno())
+
+            checkpoint['after'] = page[-1].fullname
+            checkpoint['processed'] += len(page)
+            checkpoint['written'] += written
+            save_checkpoints(checkpoints)
+
+            processed_this_run += len(page)
+            elapsed = time.perf_counter() - start
+            logger.info(f"Processed {checkpoint['processed']} posts ({checkpoint['written']} candidates), "
+                        f"{processed_this_run / elapsed:.1f} posts/second")
+
+            if len(page) < limit:
+                checkpoint['done'] = True
+                save_checkpoints(checkpoints)
+                break
+
+    elapsed = time.perf_counter() - start
+    rate = processed_this_run / elapsed if elapsed > 0 else 0.0
+    logger.info(f"Backfill finished: {processed_this_run} posts this run in {elapsed:.1f}s ({rate:.1f} posts/second)")
+    return checkpoint
+
+def main():
+    """Main function to run a backfill from the command line."""
+    parser = argparse.ArgumentParser(description="Seed the candidate store from historical top listings.")
+    parser.add_argument('--subreddit', default='BestofRedditorUpdates')
+    parser.add_argument('--time-filter', default='month', choices=['day', 'week', 'month', 'year', 'all'])
+    parser.add_argument('--max-posts', type=int, default=None, help="Stop after processing this many more posts in this run")
+    parser.add_argument('--workers', type=int, default=4, help="Number of summaries built in parallel")
+    parser.add_argument('--restart', action='store_true', help="Ignore this listing's checkpoint and start over")
+    args = parser.parse_args()
+
+    try:
+        backfill(args.subreddit, args.time_filter, args.max_posts, args.workers, args.restart)
+    except Exception as e:
+        logger.error(f"Error in backfill: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    main()